@@ -1,77 +1,465 @@
 import arcpy
 import os
+import sys
 import datetime
+import json
+import math
+import shutil
+import tempfile
 import textwrap
-from arcpy.sa import *  # Spatial Analyst
+import contextlib
+import functools
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
 except ImportError:
     requests = None
 
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:
+    rasterio = None
+
+try:
+    from numba import njit, prange, set_num_threads
+except ImportError:
+    njit = None
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+# Computed-band operators (band + band, gdal.where, gdal.log, ...) need GDAL 3.12+
+GDAL_BAND_ALGEBRA = bool(gdal) and int(gdal.VersionInfo()) >= 3120000
+GTIFF_OPTIONS = ["TILED=YES", "COMPRESS=DEFLATE", "PREDICTOR=3", "BIGTIFF=IF_SAFER"]
+
+RHO = 1.4388e-2       # h*c/k_B (m*K)
+PV_SCALE = 1 / (0.5 - 0.2)   # Pv = (NDVI - NDVIs) / (NDVIv - NDVIs), NDVIs = 0.2, NDVIv = 0.5
+PV_OFFSET = -0.2 * PV_SCALE
+NODATA = -9999.0
+ARCPY_BLOCK_SIZE = 2048
+TILE_SIZE = 1024
+
+LLM_URL = "https://api.openai.com/v1/chat/completions"
+LLM_TIMEOUT = (5, 30)  # (connect, read) seconds
+LLM_BATCH_TIMEOUT = (5, 120)
+
 # Messaging Helpers
+# Batch workers buffer (level, msg) here, since their arcpy messages never reach the tool pane
+_MESSAGE_BUFFER = None
+
 def log_message(msg):
+    if _MESSAGE_BUFFER is not None: return _MESSAGE_BUFFER.append(("message", msg))
     try: arcpy.AddMessage(msg)
     except: print(msg)
 
 def log_warning(msg):
+    if _MESSAGE_BUFFER is not None: return _MESSAGE_BUFFER.append(("warning", msg))
     try: arcpy.AddWarning(msg)
     except: print("WARNING:", msg)
 
 def log_error(msg):
+    if _MESSAGE_BUFFER is not None: return _MESSAGE_BUFFER.append(("error", msg))
     try: arcpy.AddError(msg)
     except: print("ERROR:", msg)
 
+def replay_messages(messages):
+    loggers = {"message": log_message, "warning": log_warning, "error": log_error}
+    for level, msg in messages:
+        loggers[level](msg)
+
 
 # ----------------------------------------------------------
 # API Key Handler
 # ----------------------------------------------------------
-def get_api_key(tool_param_key):
-    if tool_param_key:
-        return tool_param_key
+_API_KEY = os.environ.get("OPENAI_API_KEY") or os.environ.get("LST_TOOL_OPENAI_KEY")
+
 
-    return os.environ.get("OPENAI_API_KEY") or os.environ.get("LST_TOOL_OPENAI_KEY")
+def get_api_key(tool_param_key):
+    return tool_param_key or _API_KEY
 
 
 # ----------------------------------------------------------
 # Landsat Metadata Helpers
 # ----------------------------------------------------------
+@functools.lru_cache(maxsize=256)
+def _scan_files_cached(folder):
+    # (name, path) of regular files; DirEntry.is_file() reuses the scandir result
+    with os.scandir(folder) as it:
+        return tuple((e.name, e.path) for e in it if e.is_file())
+
+
 def find_mtl_file(folder):
-    for f in os.listdir(folder):
-        if f.upper().endswith("MTL.TXT"):
-            return os.path.join(folder, f)
+    for name, path in _scan_files_cached(folder):
+        if name.upper().endswith("MTL.TXT"):
+            return path
     return None
 
 
-def parse_mtl(path):
+# Every MTL key read by sensor detection or the LST constants, for any supported sensor
+MTL_KEYS = frozenset(
+    ["SPACECRAFT_ID", "LANDSAT_SCENE_ID"]
+    + [f"{name}_BAND_{b}" for name in ("RADIANCE_MULT", "RADIANCE_ADD", "K1_CONSTANT", "K2_CONSTANT")
+       for b in ("10", "11", "6_VCID_1")]
+    + [f"REFLECTANCE_{name}_BAND_{b}" for name in ("MULT", "ADD") for b in (3, 4, 5)]
+)
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_mtl_cached(path, mtime, keys):
     m = {}
     with open(path, "r") as f:
         for line in f:
-            if "=" in line:
-                key, val = line.split("=", 1)
-                m[key.strip()] = val.strip().strip('"')
+            key, sep, val = line.partition("=")
+            if not sep: continue
+            key = key.strip()
+            if keys and key not in keys: continue
+            m[key] = val.strip().strip('"')
     return m
 
 
+def parse_mtl(path, keys=None):
+    # mtime is part of the key so an edited MTL is re-read; callers get their own copy
+    keys = frozenset(keys) if keys else None
+    return dict(_parse_mtl_cached(path, os.path.getmtime(path), keys))
+
+
+_SPACECRAFT = {"LANDSAT_7": "L7", "LANDSAT_8": "L8", "LANDSAT_9": "L9"}
+_SCENE_PREFIX = {"LE07": "L7", "LT07": "L7", "LC08": "L8", "LO08": "L8", "LC09": "L9"}
+
+
 def detect_landsat_sensor(meta):
-    s = meta.get("SPACECRAFT_ID", "").upper()
-    if "LANDSAT_7" in s: return "L7"
-    if "LANDSAT_8" in s: return "L8"
-    if "LANDSAT_9" in s: return "L9"
-
-    scene = meta.get("LANDSAT_SCENE_ID", "").upper()
-    if scene.startswith(("LE07", "LT07")): return "L7"
-    if scene.startswith(("LC08", "LO08")): return "L8"
-    if scene.startswith(("LC09",)): return "L9"
-    return None
+    return (_SPACECRAFT.get(meta.get("SPACECRAFT_ID", "").upper())
+            or _SCENE_PREFIX.get(meta.get("LANDSAT_SCENE_ID", "")[:4].upper()))
+
 
+def index_bands(folder):
+    return {name.upper(): path for name, path in _scan_files_cached(folder)}
 
-def find_band_file(folder, suffix):
+
+def lookup_band(idx, suffix):
     suffix = suffix.upper()
-    for f in os.listdir(folder):
-        if f.upper().endswith(suffix):
-            return os.path.join(folder, f)
-    return None
+    return next((p for name, p in idx.items() if name.endswith(suffix)), None)
+
+
+# ----------------------------------------------------------
+# Running Statistics
+# ----------------------------------------------------------
+def _new_stats():
+    return {"n": 0, "sum": 0.0, "sumsq": 0.0, "min": math.inf, "max": -math.inf}
+
+
+def _accumulate_stats(acc, tile):
+    v = tile[tile != NODATA].astype(np.float64)
+    if not v.size: return
+    acc["n"] += v.size
+    acc["sum"] += v.sum()
+    acc["sumsq"] += np.dot(v, v)
+    acc["min"] = min(acc["min"], v.min())
+    acc["max"] = max(acc["max"], v.max())
+
+
+def _finalize_stats(acc):
+    n = acc["n"]
+    if not n: return None
+    mean = acc["sum"] / n
+    return {
+        "min": float(acc["min"]),
+        "max": float(acc["max"]),
+        "mean": float(mean),
+        "std": math.sqrt(max(acc["sumsq"] / n - mean * mean, 0.0))
+    }
+
+
+# ----------------------------------------------------------
+# Fused Pixel Kernel (rasterio + Numba)
+# ----------------------------------------------------------
+if njit:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def lst_kernel(red, nir, thr, rmr, rar, rmn, ran, rm, ra, k1, k2, lam_over_rho,
+                   fast_planck=False, save_ndvi=False, save_emissivity=False, save_bt=False):
+        # One pass per pixel: TOA -> NDVI -> Pv -> emissivity -> BT -> LST.
+        # DN 0 is Landsat fill and is written as NODATA in every output.
+        # Side products that are not saved stay as empty (0, 0) arrays.
+        # fast_planck replaces ln(e) with e - 1, exact to ~5e-4 over the clamped [0.97, 0.995].
+        # All inputs are float32 scalars; literals are pinned to float32 so nothing widens
+        zero, one = np.float32(0.0), np.float32(1.0)
+        pv_scale, pv_offset = np.float32(PV_SCALE), np.float32(PV_OFFSET)
+        e_slope, e_soil = np.float32(0.004), np.float32(0.986)
+        e_min, e_max = np.float32(0.97), np.float32(0.995)
+        kelvin, nodata = np.float32(273.15), np.float32(NODATA)
+
+        rows, cols = red.shape
+        lst = np.empty((rows, cols), dtype=np.float32)
+        ndvi = np.empty((rows, cols) if save_ndvi else (0, 0), dtype=np.float32)
+        emis = np.empty((rows, cols) if save_emissivity else (0, 0), dtype=np.float32)
+        bt = np.empty((rows, cols) if save_bt else (0, 0), dtype=np.float32)
+
+        for i in prange(rows):
+            for j in range(cols):
+                if red[i, j] == 0 or nir[i, j] == 0 or thr[i, j] == 0:
+                    lst[i, j] = nodata
+                    if save_ndvi: ndvi[i, j] = nodata
+                    if save_emissivity: emis[i, j] = nodata
+                    if save_bt: bt[i, j] = nodata
+                    continue
+
+                red_toa = np.float32(red[i, j]) * rmr + rar
+                nir_toa = np.float32(nir[i, j]) * rmn + ran
+                denom = nir_toa + red_toa
+                nd = (nir_toa - red_toa) / denom if denom != zero else zero
+
+                pv = nd * pv_scale + pv_offset
+                pv = min(max(pv * pv, zero), one)
+
+                e = e_slope * pv + e_soil
+                e = min(max(e, e_min), e_max)
+
+                radiance = np.float32(thr[i, j]) * rm + ra
+                b = k2 / np.log((k1 / radiance) + one)
+
+                ln_e = e - one if fast_planck else np.log(e)
+                lst[i, j] = b / (one + lam_over_rho * b * ln_e) - kelvin
+                if save_ndvi: ndvi[i, j] = nd
+                if save_emissivity: emis[i, j] = e
+                if save_bt: bt[i, j] = b
+
+        return lst, ndvi, emis, bt
+else:
+    lst_kernel = None
+
+
+def generate_tiling_grid(rows, cols, tile=TILE_SIZE, overlap=0):
+    # (row_off, col_off, height, width) tuples covering the raster, clipped at the edges
+    grid = []
+    for r0 in range(0, rows, tile):
+        for c0 in range(0, cols, tile):
+            r, c = max(r0 - overlap, 0), max(c0 - overlap, 0)
+            h = min(r0 + tile + overlap, rows) - r
+            w = min(c0 + tile + overlap, cols) - c
+            grid.append((r, c, h, w))
+    return grid
+
+
+def _init_pool_worker():
+    # Parallelism comes from the pool, so keep each worker's Numba kernel single-threaded
+    if njit: set_num_threads(1)
+
+
+def _process_pool(max_workers, initializer=None):
+    # Inside ArcGIS Pro sys.executable is ArcGISPro.exe; workers must spawn python.exe
+    if os.name == "nt":
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+    # Always spawn: a forked child inherits Numba's threading layer in a broken state
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=initializer,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def _process_tile(red_path, nir_path, thr_path, window, consts, fast_planck=False,
+                  saves=(False, False, False)):
+    r, c, h, w = window
+    win = Window(c, r, w, h)
+
+    with rasterio.open(red_path) as src: red = src.read(1, window=win)
+    with rasterio.open(nir_path) as src: nir = src.read(1, window=win)
+    with rasterio.open(thr_path) as src: thr = src.read(1, window=win)
+
+    return window, lst_kernel(red, nir, thr, *consts, fast_planck, *saves)
+
+
+def _compute_lst_rasterio(red_path, nir_path, thr_path, consts,
+                          lst_path, ndvi_path=None, emissivity_path=None, bt_path=None,
+                          max_workers=None, fast_planck=False):
+    with rasterio.open(red_path) as src:
+        profile = src.profile.copy()
+        grid = generate_tiling_grid(src.height, src.width)
+
+    profile.update(driver="GTiff", dtype="float32", count=1, nodata=NODATA,
+                   tiled=True, blockxsize=512, blockysize=512, BIGTIFF="YES",
+                   compress="deflate", predictor=3)
+
+    # Default is the in-process prange kernel; a tile pool only pays off when asked for,
+    # since every spawned worker re-imports this script (and arcpy) before its first tile
+    workers = max_workers or 1
+    stats = _new_stats()
+    saves = (bool(ndvi_path), bool(emissivity_path), bool(bt_path))
+
+    with contextlib.ExitStack() as stack:
+        # Output index matches the kernel's return order: lst, ndvi, emis, bt
+        dsts = [stack.enter_context(rasterio.open(p, "w", **profile)) if p else None
+                for p in (lst_path, ndvi_path, emissivity_path, bt_path)]
+
+        def write(window, tiles):
+            r, c, h, w = window
+            win = Window(c, r, w, h)
+            for dst, tile in zip(dsts, tiles):
+                if dst: dst.write(tile, 1, window=win)
+            _accumulate_stats(stats, tiles[0])
+
+        if workers == 1:
+            for window in grid:
+                write(*_process_tile(red_path, nir_path, thr_path, window, consts,
+                                     fast_planck, saves))
+        else:
+            # Keep only a few tiles in flight so finished results are written and freed
+            with _process_pool(workers, _init_pool_worker) as ex:
+                pending = set()
+                for window in grid:
+                    if len(pending) >= 2 * workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            write(*fut.result())
+                    pending.add(ex.submit(_process_tile, red_path, nir_path, thr_path,
+                                          window, consts, fast_planck, saves))
+                for fut in as_completed(pending):
+                    write(*fut.result())
+
+    return lst_path, _finalize_stats(stats)
+
+
+# ----------------------------------------------------------
+# Lazy Band Algebra (GDAL 3.12+)
+# ----------------------------------------------------------
+def _compute_lst_gdal(red_path, nir_path, thr_path, consts,
+                      lst_path, ndvi_path=None, emissivity_path=None, bt_path=None,
+                      fast_planck=False):
+    # Plain floats: a NumPy scalar on the left of an operator would bypass GDAL's band algebra
+    rmr, rar, rmn, ran, rm, ra, k1, k2, lam_over_rho = (float(c) for c in consts)
+    gdal.UseExceptions()
+
+    red_ds = gdal.Open(red_path)
+    nir_ds = gdal.Open(nir_path)
+    thr_ds = gdal.Open(thr_path)
+
+    red_dn = red_ds.GetRasterBand(1)
+    nir_dn = nir_ds.GetRasterBand(1)
+    thr_dn = thr_ds.GetRasterBand(1)
+
+    red = red_dn.astype(gdal.GDT_Float32)
+    nir = nir_dn.astype(gdal.GDT_Float32)
+    thr = thr_dn.astype(gdal.GDT_Float32)
+
+    # Nothing below is evaluated until CreateCopy reads the derived band
+    red_toa = red * rmr + rar
+    nir_toa = nir * rmn + ran
+    denom = nir_toa + red_toa
+    ndvi = gdal.where(denom != 0, (nir_toa - red_toa) / denom, 0)
+
+    pv = ndvi * PV_SCALE + PV_OFFSET
+    pv = gdal.maximum(gdal.minimum(pv * pv, 1), 0)
+
+    emissivity = gdal.maximum(gdal.minimum(0.004 * pv + 0.986, 0.995), 0.97)
+
+    radiance = thr * rm + ra
+    bt = k2 / gdal.log((k1 / radiance) + 1)
+
+    ln_e = emissivity - 1 if fast_planck else gdal.log(emissivity)
+    lst_c = bt / (1 + lam_over_rho * bt * ln_e) - 273.15
+
+    def masked(band):
+        band = gdal.where(thr_dn == 0, NODATA, band)
+        band = gdal.where(nir_dn == 0, NODATA, band)
+        return gdal.where(red_dn == 0, NODATA, band).astype(gdal.GDT_Float32)
+
+    stats = None
+    driver = gdal.GetDriverByName("GTiff")
+    for band, path in ((lst_c, lst_path), (ndvi, ndvi_path),
+                       (emissivity, emissivity_path), (bt, bt_path)):
+        if not path: continue
+        out = driver.CreateCopy(path, masked(band).GetDataset(), options=GTIFF_OPTIONS)
+        out.GetRasterBand(1).SetNoDataValue(NODATA)
+        if path == lst_path:
+            # ComputeStatistics raises when every pixel is NoData; stats then stay None
+            try:
+                mn, mx, mean, std = out.GetRasterBand(1).ComputeStatistics(False)
+                stats = {"min": mn, "max": mx, "mean": mean, "std": std}
+            except RuntimeError:
+                pass
+        out.Close()
+
+    return lst_path, stats
+
+
+# ----------------------------------------------------------
+# Vectorized Block Kernel (NumPy on arcpy arrays)
+# ----------------------------------------------------------
+def lst_block_numpy(red, nir, thr, rmr, rar, rmn, ran, rm, ra, k1, k2, lam_over_rho,
+                    fast_planck=False, save_ndvi=False, save_emissivity=False, save_bt=False):
+    # Same chain and return order as lst_kernel, one ndarray expression per stage.
+    # Side products that are not saved are returned as None.
+    fill = (red == 0) | (nir == 0) | (thr == 0)
+
+    # DNs stay uint16 until here; constants arrive as float32, so every stage is float32
+    red_toa = red.astype(np.float32) * rmr + rar
+    nir_toa = nir.astype(np.float32) * rmn + ran
+    denom = nir_toa + red_toa
+
+    # Fill pixels may divide by zero or log a non-positive value; they are masked below
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndvi = np.divide(nir_toa - red_toa, denom, out=np.zeros_like(denom), where=denom != 0)
+
+        pv = ndvi * np.float32(PV_SCALE) + np.float32(PV_OFFSET)
+        np.square(pv, out=pv)
+        np.clip(pv, 0.0, 1.0, out=pv)
+
+        emis = 0.004 * pv + 0.986
+        np.clip(emis, 0.97, 0.995, out=emis)
+
+        radiance = thr.astype(np.float32) * rm + ra
+        bt = k2 / np.log((k1 / radiance) + 1)
+        ln_e = emis - 1 if fast_planck else np.log(emis)
+        lst = bt / (1 + lam_over_rho * bt * ln_e) - 273.15
+
+    outs = (lst, ndvi if save_ndvi else None, emis if save_emissivity else None,
+            bt if save_bt else None)
+    for a in outs:
+        if a is not None: a[fill] = NODATA
+    return outs
+
+
+def _compute_lst_arcpy(red_path, nir_path, thr_path, consts,
+                       lst_path, ndvi_path=None, emissivity_path=None, bt_path=None,
+                       fast_planck=False):
+    desc = arcpy.Describe(red_path)
+    ext = desc.extent
+    cw, ch = desc.meanCellWidth, desc.meanCellHeight
+    nrows, ncols = desc.height, desc.width
+
+    out_paths = (lst_path, ndvi_path, emissivity_path, bt_path)
+    outs = [np.full((nrows, ncols), NODATA, dtype=np.float32) if p else None for p in out_paths]
+    stats = _new_stats()
+    saves = (bool(ndvi_path), bool(emissivity_path), bool(bt_path))
+
+    for r0, c0, h, w in generate_tiling_grid(nrows, ncols, ARCPY_BLOCK_SIZE):
+        ll = arcpy.Point(ext.XMin + c0 * cw, ext.YMax - (r0 + h) * ch)
+
+        # NoData is read as 0 so it is masked like Landsat fill
+        red = arcpy.RasterToNumPyArray(red_path, ll, w, h, 0)
+        nir = arcpy.RasterToNumPyArray(nir_path, ll, w, h, 0)
+        thr = arcpy.RasterToNumPyArray(thr_path, ll, w, h, 0)
+
+        tiles = lst_block_numpy(red, nir, thr, *consts, fast_planck, *saves)
+        for out, tile in zip(outs, tiles):
+            if out is not None: out[r0:r0 + h, c0:c0 + w] = tile
+        _accumulate_stats(stats, tiles[0])
+
+    lower_left = arcpy.Point(ext.XMin, ext.YMin)
+    with arcpy.EnvManager(compression="LZW", tileSize="512 512"):
+        for out, path in zip(outs, out_paths):
+            if out is None: continue
+            arcpy.management.CopyRaster(arcpy.NumPyArrayToRaster(out, lower_left, cw, ch, NODATA),
+                                        path, nodata_value=str(NODATA),
+                                        pixel_type="32_BIT_FLOAT", format="TIFF")
+            arcpy.management.DefineProjection(path, desc.spatialReference)
+
+    return lst_path, _finalize_stats(stats)
 
 
 # ----------------------------------------------------------
@@ -79,7 +467,9 @@ def find_band_file(folder, suffix):
 # ----------------------------------------------------------
 def compute_landsat_lst_for_scene(scene_folder, thermal_band_number=None,
                                   out_lst_path=None, save_ndvi=False,
-                                  save_emissivity=False, save_bt=False):
+                                  save_emissivity=False, save_bt=False, max_workers=None,
+                                  fast_planck=False):
+    # Returns (lst_path, stats) with stats from the write pass; raises if no pixel is valid
 
     log_message(f"Processing scene folder: {scene_folder}")
 
@@ -87,21 +477,23 @@ def compute_landsat_lst_for_scene(scene_folder, thermal_band_number=None,
     if not mtl_path:
         raise arcpy.ExecuteError(f"No MTL file found in {scene_folder}")
 
-    mtl = parse_mtl(mtl_path)
+    mtl = parse_mtl(mtl_path, MTL_KEYS)
     sensor = detect_landsat_sensor(mtl)
     if not sensor: raise arcpy.ExecuteError("Unsupported Landsat mission.")
 
     log_message(f"Detected sensor: {sensor}")
 
+    bands = index_bands(scene_folder)
+
     # ---- Band Assignment ----
     if sensor in ("L8", "L9"):
 
         tb = thermal_band_number if thermal_band_number in (10, 11) else 10
         log_message(f"Using thermal band {tb} for Landsat {sensor}.")
 
-        red_path = find_band_file(scene_folder, "_B4.TIF")
-        nir_path = find_band_file(scene_folder, "_B5.TIF")
-        thr_path = find_band_file(scene_folder, f"_B{tb}.TIF")
+        red_path = lookup_band(bands, "_B4.TIF")
+        nir_path = lookup_band(bands, "_B5.TIF")
+        thr_path = lookup_band(bands, f"_B{tb}.TIF")
 
         rad_mult = float(mtl[f"RADIANCE_MULT_BAND_{tb}"])
         rad_add = float(mtl[f"RADIANCE_ADD_BAND_{tb}"])
@@ -117,9 +509,9 @@ def compute_landsat_lst_for_scene(scene_folder, thermal_band_number=None,
     else:  # Landsat 7
         log_message("Using thermal band 6 for Landsat 7.")
 
-        red_path = find_band_file(scene_folder, "_B3.TIF")
-        nir_path = find_band_file(scene_folder, "_B4.TIF")
-        thr_path = find_band_file(scene_folder, "_B6_VCID_1.TIF") or find_band_file(scene_folder, "_B6.TIF")
+        red_path = lookup_band(bands, "_B3.TIF")
+        nir_path = lookup_band(bands, "_B4.TIF")
+        thr_path = lookup_band(bands, "_B6_VCID_1.TIF") or lookup_band(bands, "_B6.TIF")
 
         rad_mult = float(mtl["RADIANCE_MULT_BAND_6_VCID_1"])
         rad_add = float(mtl["RADIANCE_ADD_BAND_6_VCID_1"])
@@ -144,75 +536,85 @@ def compute_landsat_lst_for_scene(scene_folder, thermal_band_number=None,
     emissivity_path = os.path.join(os.path.dirname(lst_path), f"EMIS_{scene_id}.tif") if save_emissivity else None
     bt_path = os.path.join(os.path.dirname(lst_path), f"BT_{scene_id}.tif") if save_bt else None
 
-    arcpy.CheckOutExtension("Spatial")
-
-    red = Raster(red_path)
-    nir = Raster(nir_path)
-    thr = Raster(thr_path)
-
-    # ---- NDVI ----
-    red_toa = red * refl_mult_red + refl_add_red
-    nir_toa = nir * refl_mult_nir + refl_add_nir
-    ndvi = (nir_toa - red_toa) / (nir_toa + red_toa)
-
-    # ---- Pv ----
-    pv = ((ndvi - 0.2) / (0.5 - 0.2)) ** 2
-    pv = Con(pv < 0, 0, Con(pv > 1, 1, pv))
+    # Composite terms are folded here once per scene, not per pixel
+    consts = tuple(np.float32(c) for c in (refl_mult_red, refl_add_red, refl_mult_nir, refl_add_nir,
+                                           rad_mult, rad_add, k1, k2, lambda_thermal / RHO))
 
-    # ---- Emissivity ----
-    emissivity = 0.004 * pv + 0.986
-    emissivity = Con(emissivity < 0.97, 0.97, Con(emissivity > 0.995, 0.995, emissivity))
+    if rasterio and lst_kernel:
+        log_message("Using fused rasterio/Numba kernel.")
+        lst_path, stats = _compute_lst_rasterio(red_path, nir_path, thr_path, consts,
+                                                lst_path, ndvi_path, emissivity_path, bt_path,
+                                                max_workers, fast_planck)
 
-    # ---- Radiance & BT ----
-    radiance = thr * rad_mult + rad_add
-    bt = k2 / Ln((k1 / radiance) + 1)
+    elif GDAL_BAND_ALGEBRA:
+        log_message("Using GDAL band algebra.")
+        lst_path, stats = _compute_lst_gdal(red_path, nir_path, thr_path, consts,
+                                            lst_path, ndvi_path, emissivity_path, bt_path,
+                                            fast_planck)
 
-    # ---- LST ----
-    rho = 1.4388e-2
-    lst_k = bt / (1 + (lambda_thermal * bt / rho) * Ln(emissivity))
-    lst_c = lst_k - 273.15
-
-    lst_c.save(lst_path)
-
-    if save_ndvi: ndvi.save(ndvi_path)
-    if save_emissivity: emissivity.save(emissivity_path)
-    if save_bt: bt.save(bt_path)
+    else:
+        log_message("Using NumPy block processing.")
+        lst_path, stats = _compute_lst_arcpy(red_path, nir_path, thr_path, consts,
+                                             lst_path, ndvi_path, emissivity_path, bt_path,
+                                             fast_planck)
 
-    arcpy.CheckInExtension("Spatial")
+    if not stats:
+        raise arcpy.ExecuteError(f"No valid pixels in {scene_folder}; {lst_path} is entirely NoData.")
 
-    return lst_path
+    return lst_path, stats
 
 
 # ----------------------------------------------------------
 # Summary & Report
 # ----------------------------------------------------------
 def get_raster_stats(path):
-    arcpy.management.CalculateStatistics(path)
+    # Statistics are read from the Raster object rather than one GetRasterProperties tool run each
+    # Same 10x10 sampling as arcpy.env.rasterStatistics; stats written with the raster are reused
+    arcpy.management.CalculateStatistics(path, x_skip_factor=10, y_skip_factor=10,
+                                         skip_existing="SKIP_EXISTING")
+    r = arcpy.Raster(path)
     return {
-        "min": float(arcpy.GetRasterProperties_management(path, "MINIMUM").getOutput(0)),
-        "max": float(arcpy.GetRasterProperties_management(path, "MAXIMUM").getOutput(0)),
-        "mean": float(arcpy.GetRasterProperties_management(path, "MEAN").getOutput(0)),
-        "std": float(arcpy.GetRasterProperties_management(path, "STD").getOutput(0))
+        "min": float(r.minimum),
+        "max": float(r.maximum),
+        "mean": float(r.mean),
+        "std": float(r.standardDeviation)
     }
 
 
 def write_report(lst_path, stats, use_llm, api_key):
     folder = os.path.dirname(lst_path)
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    report_path = os.path.join(folder, f"LST_report_{timestamp}.txt")
+    name = os.path.splitext(os.path.basename(lst_path))[0]
+    report_path = os.path.join(folder, f"LST_report_{name}_{timestamp}.txt")
 
     with open(report_path, "w") as f:
         f.write(f"Land Surface Temperature Report\n")
         f.write(f"Raster: {os.path.basename(lst_path)}\n")
         f.write(f"Min: {stats['min']}\nMax: {stats['max']}\nMean: {stats['mean']}\nStd: {stats['std']}\n")
 
-        if use_llm:
-            response = call_llm(api_key, stats)
-            f.write("\nLLM Interpretation:\n" + response if response else "\nNo LLM summary\n")
+    if use_llm:
+        append_llm_summary(report_path, call_llm(api_key, stats))
 
     return report_path
 
 
+def append_llm_summary(report_path, response):
+    with open(report_path, "a") as f:
+        f.write("\nLLM Interpretation:\n" + response if response else "\nNo LLM summary\n")
+
+
+def _make_session():
+    # One pooled session per process so batch scenes reuse the TLS connection
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["POST"]))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry))
+    return session
+
+
+_SESSION = _make_session() if requests else None
+
+
 def call_llm(api_key, stats):
     if not api_key or not requests: return None
 
@@ -222,22 +624,96 @@ def call_llm(api_key, stats):
     """
 
     try:
-        resp = requests.post(
-            "https://api.openai.com/v1/chat/completions",
+        resp = _SESSION.post(
+            LLM_URL,
             headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={"model": "gpt-4.1-mini", "messages": [{"role": "user", "content": prompt}]}
+            json={"model": "gpt-4.1-mini", "messages": [{"role": "user", "content": prompt}]},
+            timeout=LLM_TIMEOUT
         )
+        resp.raise_for_status()
         return resp.json()["choices"][0]["message"]["content"]
 
     except:
         return None
 
 
+def call_llm_batch(api_key, all_stats):
+    # One request for the whole batch; returns {scene_id: interpretation}
+    if not api_key or not requests or not all_stats: return {}
+
+    table = [{"scene_id": scene_id, **stats} for scene_id, stats in all_stats]
+    prompt = f"""
+    Interpret the LST values of each Landsat scene below.
+    Reply with a JSON object mapping every scene_id to its interpretation.
+    {json.dumps(table)}
+    """
+
+    try:
+        resp = _SESSION.post(
+            LLM_URL,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            json={"model": "gpt-4.1-mini", "messages": [{"role": "user", "content": prompt}],
+                  "response_format": {"type": "json_object"}},
+            timeout=LLM_BATCH_TIMEOUT
+        )
+        resp.raise_for_status()
+        summaries = json.loads(resp.json()["choices"][0]["message"]["content"])
+
+    except:
+        return {}
+
+    # Anything other than {scene_id: "text"} is treated as no summary for that scene
+    if not isinstance(summaries, dict): return {}
+    return {str(k): v for k, v in summaries.items() if isinstance(v, str) and v}
+
+
+# ----------------------------------------------------------
+# Batch Worker
+# ----------------------------------------------------------
+def _configure_arcpy_env(parallel_factor="100%"):
+    arcpy.env.overwriteOutput = True
+    arcpy.env.parallelProcessingFactor = parallel_factor
+    arcpy.env.pyramid = "NONE"
+    arcpy.env.rasterStatistics = "STATISTICS 10 10"
+
+
+def _process_one_scene(args):
+    global _MESSAGE_BUFFER
+    (subfolder, out_path, thermal_band_number, save_ndvi,
+     save_emissivity, save_bt, fast_planck, parallel_factor) = args
+
+    # Messages are handed back to the parent, which replays them in the tool pane
+    _MESSAGE_BUFFER = []
+
+    # Spawned workers do not inherit arcpy.env from the parent process; each gets a share
+    # of the cores. Each scene gets its own scratch so concurrent overwrites cannot collide
+    _configure_arcpy_env(parallel_factor)
+    scratch = tempfile.mkdtemp(prefix="lst_")
+    arcpy.env.scratchWorkspace = scratch
+
+    # Failures are returned rather than raised so the buffered messages still reach the parent
+    try:
+        # Scenes already run in parallel, so tiles within a scene run serially
+        lst_path, stats = compute_landsat_lst_for_scene(subfolder, thermal_band_number, out_path,
+                                                        save_ndvi, save_emissivity, save_bt,
+                                                        max_workers=1, fast_planck=fast_planck)
+
+        # The LLM summary is requested once for the whole batch by the parent
+        report_path = write_report(lst_path, stats, False, None)
+    except Exception as e:
+        return None, None, None, _MESSAGE_BUFFER, str(e)
+    finally:
+        arcpy.env.scratchWorkspace = None
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return lst_path, stats, report_path, _MESSAGE_BUFFER, None
+
+
 # ----------------------------------------------------------
 # Main
 # ----------------------------------------------------------
 def main():
-    arcpy.env.overwriteOutput = True
+    _configure_arcpy_env()
 
     scene_or_parent = arcpy.GetParameterAsText(0)
     output_folder = arcpy.GetParameterAsText(1)
@@ -248,6 +724,7 @@ def main():
     batch_mode = bool(arcpy.GetParameter(6))
     use_llm = bool(arcpy.GetParameter(7))
     api_key = get_api_key(arcpy.GetParameterAsText(8))
+    fast_planck = bool(arcpy.GetParameter(9))
 
     thermal_band_number = int(thermal_band_param) if thermal_band_param else None
 
@@ -262,34 +739,53 @@ def main():
         scene_id = os.path.basename(scene_or_parent)
         out_path = os.path.join(output_folder, f"LST_{scene_id}.tif")
 
-        lst_path = compute_landsat_lst_for_scene(scene_or_parent, thermal_band_number, out_path,
-                                                 save_ndvi, save_emissivity, save_bt)
+        lst_path, stats = compute_landsat_lst_for_scene(scene_or_parent, thermal_band_number, out_path,
+                                                        save_ndvi, save_emissivity, save_bt,
+                                                        fast_planck=fast_planck)
 
-        stats = get_raster_stats(lst_path)
         write_report(lst_path, stats, use_llm, api_key)
 
         arcpy.SetParameterAsText(1, lst_path)
 
     else:
         # ---- Batch Mode ----
-        for name in os.listdir(scene_or_parent):
-            subfolder = os.path.join(scene_or_parent, name)
-            if not os.path.isdir(subfolder): continue
-
-            try:
-                scene_id = os.path.basename(subfolder)
-                out_path = os.path.join(output_folder, f"LST_{scene_id}.tif")
-
-                lst_path = compute_landsat_lst_for_scene(subfolder, thermal_band_number, out_path,
-                                                         save_ndvi, save_emissivity, save_bt)
-
-                stats = get_raster_stats(lst_path)
-                write_report(lst_path, stats, use_llm, api_key)
-
+        workers = max(1, (os.cpu_count() or 2) // 2)
+        parallel_factor = f"{max(1, 100 // workers)}%"
+
+        jobs = []
+        with os.scandir(scene_or_parent) as it:
+            for entry in it:
+                if not entry.is_dir(): continue
+
+                out_path = os.path.join(output_folder, f"LST_{entry.name}.tif")
+                jobs.append((entry.path, out_path, thermal_band_number, save_ndvi,
+                             save_emissivity, save_bt, fast_planck, parallel_factor))
+
+        finished = []
+        with _process_pool(workers, _init_pool_worker) as ex:
+            futures = {ex.submit(_process_one_scene, job): job[0] for job in jobs}
+
+            for fut in as_completed(futures):
+                subfolder = futures[fut]
+                try:
+                    lst_path, stats, report_path, messages, error = fut.result()
+                except Exception as e:
+                    # The worker itself died, so there are no messages to replay
+                    log_warning(f"⚠ Skipped {subfolder} — {e}")
+                    continue
+
+                replay_messages(messages)
+                if error:
+                    log_warning(f"⚠ Skipped {subfolder} — {error}")
+                    continue
+
+                finished.append((os.path.basename(subfolder), stats, report_path))
                 log_message(f"✔ Finished: {lst_path}")
 
-            except Exception as e:
-                log_warning(f"⚠ Skipped {subfolder} — {e}")
+        if use_llm:
+            summaries = call_llm_batch(api_key, [(scene_id, stats) for scene_id, stats, _ in finished])
+            for scene_id, _, report_path in finished:
+                append_llm_summary(report_path, summaries.get(scene_id))
 
 
 if __name__ == "__main__":